@@ -1,13 +1,14 @@
+import time
+_T_INICIO = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics.pairwise import euclidean_distances
-from scipy.spatial.distance import cdist
-import io
-import plotly.express as px
-import plotly.graph_objects as go
 import os
+import threading
+import importlib
+import subprocess
+import sys
 
 # Configuración de la página
 if os.path.exists('favicon.png'):
@@ -24,6 +25,119 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+# ──────────────────────────────────────────────
+# ARRANQUE RÁPIDO
+# sklearn y plotly se importan al primer uso. La base precargada y el índice
+# por segmento se construyen una sola vez por proceso, en segundo plano.
+# ──────────────────────────────────────────────
+def construir_indice_segmentos(df):
+    """Posiciones de fila por SEG26, para filtrar sin recorrer toda la base."""
+    return df.groupby('SEG26').indices
+
+
+# Línea base: lo que costaban los imports al inicio del script antes del arranque
+# diferido. Se mide a pedido en un proceso aparte para que los módulos no estén ya
+# cargados; streamlit no entra en la medición porque el servidor ya lo tiene importado.
+_CODIGO_LINEA_BASE = (
+    "import time, streamlit\n"
+    "t0 = time.perf_counter()\n"
+    "import pandas, numpy, sklearn.preprocessing, sklearn.metrics.pairwise, "
+    "scipy.spatial.distance, plotly.express, plotly.graph_objects\n"
+    "print(time.perf_counter() - t0)\n"
+)
+
+
+def medir_linea_base():
+    try:
+        salida = subprocess.run([sys.executable, '-c', _CODIGO_LINEA_BASE],
+                                capture_output=True, text=True, timeout=120, check=True)
+        return float(salida.stdout.split()[-1])
+    except (subprocess.SubprocessError, OSError, ValueError, IndexError):
+        return None
+
+
+def _precalentar(recursos):
+    t0 = time.perf_counter()
+    try:
+        base = pd.read_excel('Book.xlsx')
+        recursos['base'] = base
+        recursos['indice'] = construir_indice_segmentos(base)
+        recursos['tiempos']['Base + índice'] = time.perf_counter() - t0
+    except Exception:
+        # El reintento lo hace cargar_base_precargada en la sesión, sin relanzar este hilo
+        recursos['tiempos']['Base + índice'] = None
+    finally:
+        recursos['base_lista'].set()
+
+    modulos = [
+        ('Import sklearn', ['sklearn.preprocessing', 'sklearn.metrics.pairwise']),
+        ('Import plotly',  ['plotly.express', 'plotly.graph_objects']),
+    ]
+    for etiqueta, nombres in modulos:
+        t0 = time.perf_counter()
+        try:
+            for nombre in nombres:
+                importlib.import_module(nombre)
+            recursos['tiempos'][etiqueta] = time.perf_counter() - t0
+        except ImportError:
+            # Se reporta como no disponible; el error real aparece al primer uso
+            recursos['tiempos'][etiqueta] = None
+
+
+@st.cache_resource(show_spinner=False)
+def recursos_servidor():
+    """Precalentamiento una sola vez por proceso; nunca se limpia ni se relanza."""
+    recursos = {
+        'tiempos': {},
+        'base': None,
+        'indice': None,
+        'base_lista': threading.Event(),
+    }
+    threading.Thread(target=_precalentar, args=(recursos,), daemon=True).start()
+    return recursos
+
+
+@st.cache_resource(show_spinner=False)
+def cargar_base_precargada():
+    """Reintento si falló la carga de fondo: si lanza, no queda nada en caché."""
+    base = pd.read_excel('Book.xlsx')
+    return base, construir_indice_segmentos(base)
+
+
+def registrar_tiempo(etiqueta, segundos):
+    recursos_servidor()['tiempos'].setdefault(etiqueta, segundos)
+
+
+def obtener_base_precargada():
+    recursos = recursos_servidor()
+    recursos['base_lista'].wait()
+    if recursos['base'] is not None:
+        return recursos['base'].copy(), recursos['indice']
+    base, indice = cargar_base_precargada()
+    return base.copy(), indice
+
+
+# El costo real de importar lo mide el hilo de fondo. Aquí solo se registra
+# cuánto esperó la sesión en el primer uso (0 si el hilo ya había terminado).
+def importar_sklearn():
+    t0 = time.perf_counter()
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.metrics.pairwise import euclidean_distances
+    registrar_tiempo('Espera sklearn', time.perf_counter() - t0)
+    return StandardScaler, euclidean_distances
+
+
+def importar_plotly():
+    t0 = time.perf_counter()
+    import plotly.express as px
+    import plotly.graph_objects as go
+    registrar_tiempo('Espera plotly', time.perf_counter() - t0)
+    return px, go
+
+
+registrar_tiempo('Imports iniciales', time.perf_counter() - _T_INICIO)
+
 # CSS personalizado con colores de OXXO
 st.markdown("""
     <style>
@@ -80,33 +194,44 @@ with col_title:
         </div>
     """, unsafe_allow_html=True)
 
+registrar_tiempo('Primera pintura', time.perf_counter() - _T_INICIO)
+
 
 # ──────────────────────────────────────────────
 # MODELO ESTADÍSTICO
 # Columnas reales del Excel: VU6M (ventas últimos 6 meses), TRU6 (tráfico últimos 6 meses)
 # ──────────────────────────────────────────────
-def calcular_tienda_espejo_estadistico(df, nueva_tienda, pesos=None):
+PESOS_DEFECTO = {
+    'SEG26': 0.30,
+    'ZONA': 0.10,
+    'ESTRATO': 0.08,
+    'TIPO DE LOCAL': 0.07,
+    'AREA': 0.08,
+    'GENERADOR': 0.07,
+    'MUN': 0.06,
+    'VIVIENDAS': 0.06,
+    'EMPLEOS': 0.06,
+    'VU6M': 0.12,
+    'TRU6': 0.10
+}
+
+
+def calcular_tienda_espejo_estadistico(df, nueva_tienda, pesos=None, indice=None):
     """
     Distancia euclidiana ponderada normalizada.
     Variables numéricas: ESTRATO, AREA, VIVIENDAS, EMPLEOS, VU6M, TRU6
     Variables categóricas: ZONA, TIPO DE LOCAL, GENERADOR, MUN
+    Si se pasa `indice` (posiciones por SEG26) se usa en lugar de filtrar la base.
     """
+    StandardScaler, euclidean_distances = importar_sklearn()
+
     if pesos is None:
-        pesos = {
-            'SEG26': 0.30,
-            'ZONA': 0.10,
-            'ESTRATO': 0.08,
-            'TIPO DE LOCAL': 0.07,
-            'AREA': 0.08,
-            'GENERADOR': 0.07,
-            'MUN': 0.06,
-            'VIVIENDAS': 0.06,
-            'EMPLEOS': 0.06,
-            'VU6M': 0.12,
-            'TRU6': 0.10
-        }
+        pesos = PESOS_DEFECTO
 
-    df_filtrado = df[df['SEG26'] == nueva_tienda['SEG26']].copy()
+    if indice is not None:
+        df_filtrado = df.iloc[indice.get(nueva_tienda['SEG26'], [])].copy()
+    else:
+        df_filtrado = df[df['SEG26'] == nueva_tienda['SEG26']].copy()
 
     if len(df_filtrado) == 0:
         return None, "No se encontraron tiendas en el mismo segmento"
@@ -144,18 +269,7 @@ def calcular_tienda_espejo_estadistico(df, nueva_tienda, pesos=None):
     X_nueva_completo = np.hstack([X_num_nueva_scaled, X_cat_nueva])
 
     # ── Pesos (orden: ESTRATO, AREA, VIVIENDAS, EMPLEOS, VU6M, TRU6, ZONA, TIPO, GEN, MUN) ──
-    peso_vector = np.array([
-        pesos.get('ESTRATO', 0.08),
-        pesos.get('AREA', 0.08),
-        pesos.get('VIVIENDAS', 0.06),
-        pesos.get('EMPLEOS', 0.06),
-        pesos.get('VU6M', 0.12),
-        pesos.get('TRU6', 0.10),
-        pesos.get('ZONA', 0.10),
-        pesos.get('TIPO DE LOCAL', 0.07),
-        pesos.get('GENERADOR', 0.07),
-        pesos.get('MUN', 0.06),
-    ])
+    peso_vector = np.array([pesos.get(v, PESOS_DEFECTO[v]) for v in vars_numericas + vars_categoricas])
 
     X_df_ponderado = X_df_completo * np.sqrt(peso_vector)
     X_nueva_ponderado = X_nueva_completo * np.sqrt(peso_vector)
@@ -205,6 +319,105 @@ def calcular_estadisticas(df_resultado, nueva_tienda):
     return stats
 
 
+# ──────────────────────────────────────────────
+# BACKTEST LEAVE-ONE-OUT
+# Cada tienda existente actúa como nueva propuesta con su VU6M/TRU6 oculto
+# ──────────────────────────────────────────────
+MAX_CELDAS_BACKTEST = 2_000_000
+
+
+def backtest_leave_one_out(df, pesos=None, k=10, indice=None):
+    """
+    Mide qué tan bien la media del top-K de espejos estima VU6M y TRU6.
+    Por segmento se calculan las distancias ponderadas en bloque (por grupos de
+    filas) y se enmascara la diagonal para que ninguna tienda sea su propio espejo.
+    VU6M y TRU6 no entran en la distancia porque son el valor a estimar.
+    """
+    if pesos is None:
+        pesos = PESOS_DEFECTO
+
+    vars_numericas = ['ESTRATO', 'AREA', 'VIVIENDAS', 'EMPLEOS']
+    vars_categoricas = ['ZONA', 'TIPO DE LOCAL', 'GENERADOR', 'MUN']
+
+    peso_num = np.array([pesos.get(v, PESOS_DEFECTO[v]) for v in vars_numericas])
+    peso_cat = np.array([pesos.get(v, PESOS_DEFECTO[v]) for v in vars_categoricas])
+
+    if indice is None:
+        indice = construir_indice_segmentos(df)
+
+    # ── Categóricas a códigos enteros, una sola vez para toda la base ──
+    # Un valor vacío nunca coincide (igual que NaN == x en el modelo individual),
+    # así que cada fila vacía recibe su propio código negativo.
+    codigos = np.column_stack([pd.factorize(df[var])[0] for var in vars_categoricas])
+    vacias = codigos == -1
+    codigos[vacias] = -1 - np.nonzero(vacias)[0]
+
+    bloques = []
+    for posiciones in indice.values():
+        df_seg = df.iloc[posiciones]
+        n = len(df_seg)
+        if n < 2:
+            continue
+        k_seg = min(k, n - 1)
+
+        # ── Parte numérica: escalado sin la tienda evaluada, como en el modelo individual ──
+        # La media se cancela en las diferencias; solo importa la varianza de los otros n-1.
+        X_num = df_seg[vars_numericas].fillna(0).to_numpy(dtype=float)
+        S = X_num.sum(axis=0)
+        Q = (X_num ** 2).sum(axis=0)
+        media_sin = (S - X_num) / (n - 1)
+        var_sin = (Q - X_num ** 2) / (n - 1) - media_sin ** 2
+        # Variable constante entre los otros: StandardScaler usa escala 1
+        var_sin = np.where(var_sin <= 1e-10 * np.maximum(media_sin ** 2, 1.0), 1.0, var_sin)
+        peso_fila = peso_num / var_sin
+        codigos_seg = codigos[posiciones]
+
+        # ── Distancias por bloques de filas para acotar la memoria en segmentos grandes ──
+        vecinos = np.empty((n, k_seg), dtype=np.intp)
+        filas_bloque = max(1, MAX_CELDAS_BACKTEST // n)
+        for inicio in range(0, n, filas_bloque):
+            filas = np.arange(inicio, min(inicio + filas_bloque, n))
+
+            dif = X_num[None, :, :] - X_num[filas, None, :]
+            d2 = (dif ** 2 * peso_fila[filas, None, :]).sum(axis=2)
+
+            # Parte categórica: 1 si no coincide (igual que el modelo individual)
+            d2 += (codigos_seg[filas, None, :] != codigos_seg[None, :, :]) @ peso_cat
+
+            # Máscara de auto-exclusión
+            d2[np.arange(len(filas)), filas] = np.inf
+            vecinos[filas] = np.argpartition(d2, k_seg - 1, axis=1)[:, :k_seg]
+
+        bloque = df_seg[['CR', 'NAME', 'SEG26']].copy()
+        for col in ['VU6M', 'TRU6']:
+            reales = df_seg[col].fillna(0).to_numpy(dtype=float)
+            bloque[col] = reales
+            bloque[f'{col}_EST'] = reales[vecinos].mean(axis=1)
+        bloque['K'] = k_seg
+        bloques.append(bloque)
+
+    if not bloques:
+        return None, "Ningún segmento tiene al menos 2 tiendas para el backtest"
+
+    return pd.concat(bloques), None
+
+
+def calcular_metricas_backtest(df_bt):
+    metricas = {}
+    for col in ['VU6M', 'TRU6']:
+        reales = df_bt[col].to_numpy(dtype=float)
+        error = df_bt[f'{col}_EST'].to_numpy(dtype=float) - reales
+        con_valor = reales != 0
+        metricas[col] = {
+            'MAE':  np.abs(error).mean(),
+            'RMSE': np.sqrt((error ** 2).mean()),
+            'MAPE': (np.abs(error[con_valor]) / np.abs(reales[con_valor])).mean() * 100 if con_valor.any() else np.nan,
+            'SESGO': error.mean(),
+        }
+    metricas['n'] = len(df_bt)
+    return metricas
+
+
 # ──────────────────────────────────────────────
 # SIDEBAR
 # ──────────────────────────────────────────────
@@ -212,10 +425,11 @@ with st.sidebar:
     st.header("📂 Cargar Datos")
 
     usar_ejemplo = st.checkbox("Usar datos precargados", value=True)
+    indice = None
 
     if usar_ejemplo:
         try:
-            df = pd.read_excel('Book.xlsx')
+            df, indice = obtener_base_precargada()
             st.markdown(f"""
                 <div style='background-color: #ED1C24; padding: 0.8rem; border-radius: 5px; 
                             color: white; border-left: 4px solid #FFD100;'>
@@ -230,6 +444,7 @@ with st.sidebar:
         uploaded_file = st.file_uploader("Sube tu archivo Excel", type=['xlsx', 'xls'])
         if uploaded_file:
             df = pd.read_excel(uploaded_file)
+            indice = construir_indice_segmentos(df)
             st.markdown(f"""
                 <div style='background-color: #ED1C24; padding: 0.8rem; border-radius: 5px; 
                             color: white; border-left: 4px solid #FFD100;'>
@@ -371,7 +586,9 @@ if df is not None:
                 'TRU6':      tru6,
             }
 
-            resultado, error = calcular_tienda_espejo_estadistico(df, nueva_tienda, pesos)
+            t0 = time.perf_counter()
+            resultado, error = calcular_tienda_espejo_estadistico(df, nueva_tienda, pesos, indice)
+            registrar_tiempo('Primera consulta', time.perf_counter() - t0)
 
             if error:
                 st.error(error)
@@ -482,6 +699,7 @@ if df is not None:
                 st.divider()
 
                 # Visualizaciones
+                px, go = importar_plotly()
                 st.markdown("### 📊 Análisis Visual")
 
                 tab1, tab2, tab3, tab4, tab5 = st.tabs([
@@ -671,6 +889,69 @@ if df is not None:
                     fig_rel.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
                     st.plotly_chart(fig_rel, use_container_width=True)
 
+    # ── Backtest del estimado por espejos ──
+    st.divider()
+    with st.expander("🧪 Backtest del Modelo (Leave-One-Out)", expanded=False):
+        st.caption("Cada tienda se trata como nueva propuesta con su VU6M/TRU6 oculto; "
+                   "se estima con la media de sus K espejos del mismo segmento.")
+        k_backtest = st.slider("K (espejos promediados)", 1, 30, 10)
+
+        # Sin valores reales de VU6M/TRU6 no hay nada contra qué medir el error
+        objetivos = []
+        for col, etiqueta, prefijo in [('VU6M', '💰 Ventas U6M', '$'), ('TRU6', '🚶 Tráfico U6M', '')]:
+            if not df[col].fillna(0).astype(bool).any():
+                st.warning(f"⚠️ La columna **{col}** no tiene valores distintos de 0; se omite del backtest.")
+            else:
+                objetivos.append((col, etiqueta, prefijo))
+
+        if objetivos and st.button("▶️ Ejecutar Backtest", use_container_width=True):
+            t0 = time.perf_counter()
+            df_bt, error_bt = backtest_leave_one_out(df, pesos, k_backtest, indice)
+            df_bt_base, _   = backtest_leave_one_out(df, None, k_backtest, indice)
+            duracion = time.perf_counter() - t0
+
+            if error_bt:
+                st.error(error_bt)
+            else:
+                met      = calcular_metricas_backtest(df_bt)
+                met_base = calcular_metricas_backtest(df_bt_base)
+                px, go   = importar_plotly()
+                st.caption(f"{met['n']:,} tiendas evaluadas en {duracion:.2f}s · "
+                           f"delta vs pesos por defecto (negativo = mejora)")
+
+                for col, etiqueta, prefijo in objetivos:
+                    st.markdown(f"##### {etiqueta}")
+                    c1, c2, c3, c4 = st.columns(4)
+                    with c1:
+                        st.metric("MAE", f"{prefijo}{met[col]['MAE']:,.0f}",
+                                  f"{met[col]['MAE'] - met_base[col]['MAE']:,.0f}", delta_color="inverse")
+                    with c2:
+                        st.metric("RMSE", f"{prefijo}{met[col]['RMSE']:,.0f}",
+                                  f"{met[col]['RMSE'] - met_base[col]['RMSE']:,.0f}", delta_color="inverse")
+                    with c3:
+                        st.metric("MAPE", f"{met[col]['MAPE']:.1f}%",
+                                  f"{met[col]['MAPE'] - met_base[col]['MAPE']:.1f}%", delta_color="inverse")
+                    with c4:
+                        st.metric("Sesgo", f"{prefijo}{met[col]['SESGO']:,.0f}")
+
+                col, etiqueta, _ = objetivos[0]
+                fig_bt = px.scatter(df_bt, x=col, y=f'{col}_EST', hover_data=['NAME', 'SEG26'],
+                                    title=f'{etiqueta}: Real vs Estimado por Espejos',
+                                    labels={col: 'Real', f'{col}_EST': 'Estimado'},
+                                    color_discrete_sequence=['#ED1C24'])
+                lim = max(df_bt[col].max(), df_bt[f'{col}_EST'].max())
+                fig_bt.add_trace(go.Scatter(x=[0, lim], y=[0, lim], mode='lines',
+                                            line=dict(color='#FFD100', dash='dash'), name='Ideal'))
+                fig_bt.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
+                st.plotly_chart(fig_bt, use_container_width=True)
+
+                st.download_button(
+                    label="📥 Descargar Backtest (CSV)",
+                    data=df_bt.to_csv(index=False),
+                    file_name=f"backtest_espejo_k{k_backtest}.csv",
+                    mime="text/csv"
+                )
+
 else:
     st.info("👈 Por favor, carga un archivo Excel en la barra lateral para comenzar")
     st.markdown("""
@@ -687,6 +968,43 @@ else:
     Asegúrate de que tu archivo Excel incluya estas columnas con esos nombres exactos.
     """)
 
+# Reporte de arranque (primera medición de este proceso del servidor)
+with st.sidebar:
+    with st.expander("⏱️ Tiempos de arranque"):
+        recursos = recursos_servidor()
+        if st.button("📏 Medir línea base", use_container_width=True):
+            with st.spinner("Midiendo imports en un proceso nuevo..."):
+                recursos['tiempos']['Línea base'] = medir_linea_base()
+        tiempos = dict(recursos['tiempos'])
+
+        st.markdown("**En la sesión**")
+        for etiqueta in ['Imports iniciales', 'Primera pintura', 'Espera sklearn',
+                         'Espera plotly', 'Primera consulta']:
+            if etiqueta in tiempos:
+                seg = tiempos[etiqueta]
+                st.write(f"{'✅' if seg < 1 else '⚠️'} **{etiqueta}:** {seg * 1000:,.0f} ms")
+
+        st.markdown("**En segundo plano**")
+        for etiqueta in ['Base + índice', 'Import sklearn', 'Import plotly']:
+            if etiqueta in tiempos:
+                seg = tiempos[etiqueta]
+                st.write(f"**{etiqueta}:** {f'{seg * 1000:,.0f} ms' if seg is not None else 'no disponible'}")
+
+        linea_base = tiempos.get('Línea base')
+        if linea_base is not None and 'Primera pintura' in tiempos:
+            st.markdown("**Antes vs ahora (primera pintura)**")
+            st.metric("Imports al inicio → diferidos",
+                      f"{tiempos['Primera pintura'] * 1000:,.0f} ms",
+                      f"{(tiempos['Primera pintura'] - linea_base) * 1000:,.0f} ms vs {linea_base * 1000:,.0f} ms",
+                      delta_color="inverse")
+            st.caption("Línea base: imports de pandas, numpy, sklearn, scipy y plotly "
+                       "en un proceso nuevo, como los hacía el script antes.")
+        elif 'Línea base' in tiempos:
+            st.caption("⚠️ No se pudo medir la línea base en este entorno.")
+
+        st.caption(f"Esta ejecución: {(time.perf_counter() - _T_INICIO) * 1000:,.0f} ms")
+        st.caption("Base, índice, sklearn y plotly se cargan una vez por proceso, en segundo plano.")
+
 # Footer
 st.divider()
 st.markdown("""